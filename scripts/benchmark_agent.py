@@ -0,0 +1,553 @@
+import argparse
+import contextlib
+import contextvars
+import importlib.util
+import json
+import math
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+NOTEBOOK_PATH = REPO_ROOT / "notebooks" / "driver.ipynb"
+AGENT_CELL_MAGIC = "%%writefile agent.py"
+
+DEFAULTS = {
+    "mode": "both",
+    "requests": 200,
+    "concurrency": 16,
+    "warmup": 5,
+    "distinct_prompts": 0,
+    "llm_ttft_ms": 150,
+    "llm_token_ms": 10,
+    "answer_tokens": 40,
+    "tool_calls": "system__ai__python_exec,word_count,echo_text",
+    "uc_latency_ms": 250,
+    "stream_tokens": 2000,
+    "stream_repeats": 20,
+    "capacity_levels": "1,2,4,8,16,32",
+    "capacity_requests": 32,
+    "target_qps": 5.0,
+    "target_p95_ms": 5000,
+}
+
+# Provisioned concurrency range of each serving workload size, smallest first
+WORKLOAD_SIZES = (("Small", 4), ("Medium", 16), ("Large", 64))
+# Serving scales provisioned concurrency in steps of this many requests
+CONCURRENCY_STEP = 4
+
+UC_TOOL_SPECS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "system__ai__python_exec",
+            "description": "Executes Python code and returns its stdout.",
+            "parameters": {
+                "type": "object",
+                "properties": {"code": {"type": "string"}},
+                "required": ["code"],
+            },
+        },
+    }
+]
+
+# Per-request tool-phase wall time, shared by reference with the agent's event loop
+BENCH_TOOL_SECONDS = contextvars.ContextVar("bench_tool_seconds")
+
+
+def load_agent_module(notebook_path=NOTEBOOK_PATH):
+    notebook = json.loads(Path(notebook_path).read_text(encoding="utf-8"))
+    for cell in notebook["cells"]:
+        source = "".join(cell.get("source", []))
+        if cell.get("cell_type") == "code" and source.startswith(AGENT_CELL_MAGIC):
+            break
+    else:
+        raise RuntimeError(f"No '{AGENT_CELL_MAGIC}' cell found in {notebook_path}.")
+
+    agent_path = Path(tempfile.mkdtemp(prefix="agent-bench-")) / "agent.py"
+    agent_path.write_text(source.split("\n", 1)[1], encoding="utf-8")
+    spec = importlib.util.spec_from_file_location("agent", agent_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["agent"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def stub_chunk(chunk_id, delta, finish_reason=None):
+    return {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "stub",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def stub_tool_args(tool_name, prompt):
+    if tool_name == "system__ai__python_exec":
+        return {"code": f"print(len({prompt!r}))"}
+    if tool_name == "get_utc_timestamp":
+        return {}
+    return {"text": prompt}
+
+
+def stub_completion_chunks(body, tool_names, answer_tokens):
+    """Scripted turn: tool calls when the last message is from the user, an answer otherwise."""
+    messages = body.get("messages", [])
+    last = messages[-1] if messages else {}
+    offered = {tool["function"]["name"] for tool in body.get("tools") or []}
+    calls = [name for name in tool_names if name in offered]
+    if last.get("role") == "user" and calls:
+        chunks = []
+        for index, name in enumerate(calls):
+            arguments = json.dumps(stub_tool_args(name, str(last.get("content", ""))))
+            split = len(arguments) // 2
+            tool_call = {"index": index, "id": f"call_{index}", "type": "function"}
+            chunks.append(
+                stub_chunk("stub-tools", {"role": "assistant", "tool_calls": [{**tool_call, "function": {"name": name, "arguments": arguments[:split]}}]})
+            )
+            chunks.append(stub_chunk("stub-tools", {"tool_calls": [{"index": index, "function": {"arguments": arguments[split:]}}]}))
+        chunks.append(stub_chunk("stub-tools", {}, "tool_calls"))
+        return chunks
+    chunks = [stub_chunk("stub-answer", {"role": "assistant", "content": f"token{i} "}) for i in range(answer_tokens)]
+    chunks.append(stub_chunk("stub-answer", {}, "stop"))
+    return chunks
+
+
+def start_stub_llm(ttft_ms, token_ms, tool_names, answer_tokens):
+    """Serves a streaming OpenAI chat-completions stand-in on a free localhost port."""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(ttft_ms / 1000)
+            for chunk in stub_completion_chunks(body, tool_names, answer_tokens):
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                time.sleep(token_ms / 1000)
+            self.write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def write_chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+class FakeFunctionResult:
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+
+class FakeUCFunctionClient:
+    """Stands in for the UC function client, sleeping to emulate serverless execution latency."""
+
+    def __init__(self, latency_ms):
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def execute_function(self, function_name, parameters=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        return FakeFunctionResult(value=f"{function_name} ok")
+
+
+def build_agent(agent_module, llm_base_url, uc_client, **agent_kwargs):
+    from openai import AsyncOpenAI
+
+    # Serve UC tool specs from a snapshot and UC executions from the fake client,
+    # so nothing reaches a workspace
+    snapshot_path = Path(tempfile.mkdtemp(prefix="agent-bench-")) / "uc_tool_specs.json"
+    snapshot_path.write_text(
+        json.dumps({"function_names": agent_module.UC_TOOL_NAMES, "tools": UC_TOOL_SPECS}), encoding="utf-8"
+    )
+    agent_module.UC_EXECUTOR.client = uc_client
+    registry = agent_module.ToolRegistry(agent_module.UC_TOOL_NAMES, agent_module.TOOL_INFOS)
+    registry.uc_tool_specs_path = str(snapshot_path)
+
+    agent = agent_module.ToolCallingAgent(
+        llm_endpoint="stub-llm",
+        tools=registry,
+        model_serving_client=AsyncOpenAI(base_url=llm_base_url, api_key="stub", max_retries=0),
+        **agent_kwargs,
+    )
+    handle_tool_calls = agent.handle_tool_calls
+
+    async def timed_handle_tool_calls(*args, **kwargs):
+        # Tools started speculatively during the LLM stream only count for the time still waited here
+        started = time.perf_counter()
+        try:
+            return await handle_tool_calls(*args, **kwargs)
+        finally:
+            seconds = BENCH_TOOL_SECONDS.get(None)
+            if seconds is not None:
+                seconds[0] += time.perf_counter() - started
+
+    agent.handle_tool_calls = timed_handle_tool_calls
+    return agent
+
+
+def load_request_mix(path):
+    """
+    Reads recorded requests from a JSONL file: raw ResponsesAgent requests ({"input": [...]}),
+    EvalRunner result rows ({"inputs": {...}}) or inference table rows ({"request": {...}}).
+    """
+    requests = []
+    for line_number, line in enumerate(Path(path).read_text(encoding="utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        request = row.get("request", row.get("inputs", row))
+        if isinstance(request, str):
+            request = json.loads(request)
+        if not isinstance(request, dict) or "input" not in request:
+            raise ValueError(f"{path}:{line_number} is not a ResponsesAgent request (no 'input').")
+        requests.append(request)
+    if not requests:
+        raise ValueError(f"No requests found in {path}.")
+    return requests
+
+
+def make_request(index, distinct_prompts, request_mix=None):
+    if request_mix:
+        return request_mix[index % len(request_mix)]
+    prompt_id = index % distinct_prompts if distinct_prompts else index
+    return {"input": [{"role": "user", "content": f"benchmark prompt {prompt_id}"}]}
+
+
+def run_one(agent, mode, request):
+    tool_seconds = [0.0]
+    BENCH_TOOL_SECONDS.set(tool_seconds)
+    started = time.perf_counter()
+    ttft = None
+    if mode == "predict":
+        agent.predict(request)
+    else:
+        for event in agent.predict_stream(request):
+            if ttft is None and event.type == "response.output_text.delta":
+                ttft = time.perf_counter() - started
+    return {"latency": time.perf_counter() - started, "ttft": ttft, "tool_seconds": tool_seconds[0]}
+
+
+def run_load(agent, mode, num_requests, concurrency, distinct_prompts, warmup, request_mix=None):
+    for index in range(warmup):
+        run_one(agent, mode, make_request(-1 - index, 0, request_mix))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(
+                contextvars.copy_context().run, run_one, agent, mode, make_request(i, distinct_prompts, request_mix)
+            )
+            for i in range(num_requests)
+        ]
+        samples = [future.result() for future in futures]
+    return samples, time.perf_counter() - started
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(mode, samples, wall_seconds, concurrency):
+    def ms_stats(values):
+        return {f"p{pct}": round(percentile(values, pct) * 1000, 1) for pct in (50, 95, 99)} if values else None
+
+    latencies = [sample["latency"] for sample in samples]
+    return {
+        "mode": mode,
+        "requests": len(samples),
+        "concurrency": concurrency,
+        "requests_per_sec": round(len(samples) / wall_seconds, 2),
+        "latency_ms": ms_stats(latencies),
+        "latency_mean_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+        "ttft_ms": ms_stats([sample["ttft"] for sample in samples if sample["ttft"] is not None]),
+        "tool_share": round(sum(sample["tool_seconds"] for sample in samples) / sum(latencies), 3),
+    }
+
+
+def print_report(summaries):
+    header = f"{'mode':<15}{'req/s':>9}{'lat p50':>10}{'lat p95':>10}{'lat p99':>10}{'ttft p50':>10}{'ttft p95':>10}{'ttft p99':>10}{'tool %':>8}"
+    print(header)
+    print("-" * len(header))
+    for summary in summaries:
+        latency = summary["latency_ms"]
+        ttft = summary["ttft_ms"] or {"p50": "-", "p95": "-", "p99": "-"}
+        print(
+            f"{summary['mode']:<15}{summary['requests_per_sec']:>9}"
+            f"{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}"
+            f"{ttft['p50']:>10}{ttft['p95']:>10}{ttft['p99']:>10}"
+            f"{summary['tool_share'] * 100:>7.1f}%"
+        )
+
+
+@contextlib.contextmanager
+def stub_agent(options):
+    """Yields an agent wired to the LLM stub and a fake UC client; the stub stops on exit."""
+    import mlflow
+
+    # Tracing export would dominate an offline benchmark
+    mlflow.tracing.disable()
+    agent_module = load_agent_module(options.notebook)
+    tool_names = [name for name in options.tool_calls.split(",") if name]
+    server, base_url = start_stub_llm(options.llm_ttft_ms, options.llm_token_ms, tool_names, options.answer_tokens)
+    try:
+        uc_client = FakeUCFunctionClient(options.uc_latency_ms)
+        yield build_agent(
+            agent_module, base_url, uc_client, speculative_tool_dispatch=not options.no_speculative_tools
+        )
+    finally:
+        server.shutdown()
+
+
+def run_benchmark(options):
+    request_mix = load_request_mix(options.request_mix) if options.request_mix else None
+    with stub_agent(options) as agent:
+        modes = ["predict", "predict_stream"] if options.mode == "both" else [options.mode]
+        summaries = []
+        for mode in modes:
+            samples, wall_seconds = run_load(
+                agent,
+                mode,
+                options.requests,
+                options.concurrency,
+                options.distinct_prompts,
+                options.warmup,
+                request_mix,
+            )
+            summaries.append(summarize(mode, samples, wall_seconds, options.concurrency))
+        return summaries
+
+
+def run_capacity_curve(options):
+    """
+    Throughput and latency of a single agent process (one serving replica) at each concurrency
+    level, replaying the request mix. Each level runs at least four requests per caller.
+    """
+    request_mix = load_request_mix(options.request_mix) if options.request_mix else None
+    levels = sorted({int(level) for level in options.capacity_levels.split(",") if level})
+    mode = "predict" if options.mode == "both" else options.mode
+    curve = []
+    with stub_agent(options) as agent:
+        for level in levels:
+            num_requests = max(options.capacity_requests, 4 * level)
+            samples, wall_seconds = run_load(
+                agent, mode, num_requests, level, options.distinct_prompts, options.warmup, request_mix
+            )
+            curve.append(summarize(mode, samples, wall_seconds, level))
+    return curve
+
+
+def recommend_capacity(curve, target_qps, target_p95_ms):
+    """
+    Picks the highest-throughput point on the curve whose p95 meets the target and sizes the
+    endpoint with Little's law: requests in flight = target QPS x mean latency at that point.
+    """
+    within_target = [point for point in curve if point["latency_ms"]["p95"] <= target_p95_ms]
+    notes = []
+    if within_target:
+        point = max(within_target, key=lambda point: point["requests_per_sec"])
+    else:
+        point = min(curve, key=lambda point: point["latency_ms"]["p95"])
+        notes.append(
+            f"No concurrency level met p95 <= {target_p95_ms} ms (best {point['latency_ms']['p95']} ms "
+            f"at concurrency {point['concurrency']}); sizing for that level."
+        )
+
+    in_flight = target_qps * point["latency_mean_ms"] / 1000
+    min_concurrency = max(CONCURRENCY_STEP, math.ceil(in_flight / CONCURRENCY_STEP) * CONCURRENCY_STEP)
+    for workload_size, max_concurrency in WORKLOAD_SIZES:
+        if min_concurrency <= max_concurrency:
+            break
+    else:
+        notes.append(
+            f"{min_concurrency} concurrent requests exceed the {workload_size} workload size "
+            f"({max_concurrency}); split traffic across endpoints or raise the limit in the Serving UI."
+        )
+    return {
+        "target_qps": target_qps,
+        "target_p95_ms": target_p95_ms,
+        "replica_concurrency": point["concurrency"],
+        "replica_requests_per_sec": point["requests_per_sec"],
+        "replica_latency_ms": point["latency_ms"],
+        "replicas": math.ceil(target_qps / point["requests_per_sec"]),
+        "min_provisioned_concurrency": min_concurrency,
+        "workload_size": workload_size,
+        # Cold starts from zero would blow the p95 target as soon as traffic resumes
+        "scale_to_zero_enabled": False,
+        "meets_target": bool(within_target),
+        "notes": notes,
+    }
+
+
+def plan_capacity(options):
+    curve = run_capacity_curve(options)
+    return {
+        # The curve measures the agent's own overhead around these stand-ins, not the real endpoint
+        "assumptions": {
+            "llm_ttft_ms": options.llm_ttft_ms,
+            "llm_token_ms": options.llm_token_ms,
+            "answer_tokens": options.answer_tokens,
+            "uc_latency_ms": options.uc_latency_ms,
+        },
+        "curve": curve,
+        "recommendation": recommend_capacity(curve, options.target_qps, options.target_p95_ms),
+    }
+
+
+def print_capacity_plan(plan):
+    header = f"{'concurrency':<13}{'req/s':>9}{'lat mean':>10}{'lat p50':>10}{'lat p95':>10}{'lat p99':>10}"
+    print(header)
+    print("-" * len(header))
+    for point in plan["curve"]:
+        latency = point["latency_ms"]
+        print(
+            f"{point['concurrency']:<13}{point['requests_per_sec']:>9}{point['latency_mean_ms']:>10}"
+            f"{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}"
+        )
+    recommendation = plan["recommendation"]
+    print(
+        f"\nFor {recommendation['target_qps']} req/s at p95 <= {recommendation['target_p95_ms']} ms: "
+        f"workload size {recommendation['workload_size']}, min provisioned concurrency "
+        f"{recommendation['min_provisioned_concurrency']}, scale to zero "
+        f"{'on' if recommendation['scale_to_zero_enabled'] else 'off'} "
+        f"(~{recommendation['replicas']} replica(s) at {recommendation['replica_requests_per_sec']} req/s "
+        f"and concurrency {recommendation['replica_concurrency']} each)"
+    )
+    for note in recommendation["notes"]:
+        print(f"Note: {note}")
+    assumptions = plan["assumptions"]
+    print(
+        f"Assumes an LLM with {assumptions['llm_ttft_ms']} ms to first token and {assumptions['llm_token_ms']} ms "
+        f"per chunk ({assumptions['answer_tokens']}-token answers) and {assumptions['uc_latency_ms']} ms UC "
+        "function calls; rerun with measured values (--llm-ttft-ms, --llm-token-ms, --uc-latency-ms) "
+        "if the real endpoint differs."
+    )
+
+
+def run_stream_overhead(options):
+    """
+    Per-token cost of turning a streamed answer into output items, without any network: the
+    previous path (chunk.to_dict() under catch_warnings, then mlflow's dict-based converter)
+    against the agent's ChatCompletionStreamAggregator in streaming and non-streaming mode.
+    """
+    from mlflow.types.responses import output_to_responses_items_stream
+    from openai.types.chat import ChatCompletionChunk
+
+    agent_module = load_agent_module(options.notebook)
+    chunks = [
+        ChatCompletionChunk.model_validate(stub_chunk("bench", {"content": f"tok{i} "}))
+        for i in range(options.stream_tokens)
+    ]
+
+    def chunk_dicts():
+        for chunk in chunks:
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", message="PydanticSerializationUnexpectedValue")
+                chunk_dict = chunk.to_dict()
+            if chunk_dict.get("choices"):
+                yield chunk_dict
+
+    def before():
+        for _ in output_to_responses_items_stream(chunk_dicts(), []):
+            pass
+
+    def after(stream_deltas):
+        aggregator = agent_module.ChatCompletionStreamAggregator([], stream_deltas=stream_deltas)
+        for chunk in chunks:
+            if chunk.choices:
+                aggregator.add(chunk)
+        aggregator.finish()
+
+    variants = {
+        "before (to_dict + mlflow converter)": before,
+        "after, predict_stream": lambda: after(True),
+        "after, predict": lambda: after(False),
+    }
+    results = {}
+    for name, fn in variants.items():
+        best = min(timed(fn) for _ in range(options.stream_repeats))
+        results[name] = round(best / options.stream_tokens * 1e6, 2)
+    return {"mode": "stream_overhead", "tokens": options.stream_tokens, "us_per_token": results}
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def print_stream_overhead(result):
+    print(f"Stream processing overhead over {result['tokens']} tokens (best of runs, microseconds per token)")
+    for name, us_per_token in result["us_per_token"].items():
+        print(f"  {name:<40}{us_per_token:>8}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Offline load test of the ToolCallingAgent against a local LLM stub.")
+    parser.add_argument("--notebook", default=str(NOTEBOOK_PATH), help="Notebook containing the agent.py cell")
+    parser.add_argument("--mode", choices=["predict", "predict_stream", "both"], default=DEFAULTS["mode"])
+    parser.add_argument("--requests", type=int, default=DEFAULTS["requests"], help="Measured requests per mode")
+    parser.add_argument("--concurrency", type=int, default=DEFAULTS["concurrency"], help="Concurrent callers")
+    parser.add_argument("--warmup", type=int, default=DEFAULTS["warmup"], help="Unmeasured requests before each run")
+    parser.add_argument("--distinct-prompts", type=int, default=DEFAULTS["distinct_prompts"], help="Cycle through N prompts (0 = all distinct)")
+    parser.add_argument("--llm-ttft-ms", type=float, default=DEFAULTS["llm_ttft_ms"], help="Stub delay before the first chunk")
+    parser.add_argument("--llm-token-ms", type=float, default=DEFAULTS["llm_token_ms"], help="Stub delay between chunks")
+    parser.add_argument("--answer-tokens", type=int, default=DEFAULTS["answer_tokens"], help="Chunks in the final answer")
+    parser.add_argument("--tool-calls", default=DEFAULTS["tool_calls"], help="Comma-separated tools the stub calls on each user turn")
+    parser.add_argument("--uc-latency-ms", type=float, default=DEFAULTS["uc_latency_ms"], help="Fake UC function execution latency")
+    parser.add_argument("--no-speculative-tools", action="store_true", help="Run tools only after the LLM turn has finished streaming")
+    parser.add_argument("--stream-overhead", action="store_true", help="Run the per-token stream-processing micro-benchmark instead of the load test")
+    parser.add_argument("--stream-tokens", type=int, default=DEFAULTS["stream_tokens"], help="Answer tokens in the micro-benchmark stream")
+    parser.add_argument("--stream-repeats", type=int, default=DEFAULTS["stream_repeats"], help="Micro-benchmark runs per variant (best is reported)")
+    parser.add_argument("--request-mix", help="JSONL of recorded requests to replay instead of synthetic prompts")
+    parser.add_argument("--capacity", action="store_true", help="Measure a throughput/latency curve and recommend serving capacity")
+    parser.add_argument("--capacity-levels", default=DEFAULTS["capacity_levels"], help="Comma-separated concurrency levels for --capacity")
+    parser.add_argument("--capacity-requests", type=int, default=DEFAULTS["capacity_requests"], help="Minimum measured requests per --capacity level")
+    parser.add_argument("--target-qps", type=float, default=DEFAULTS["target_qps"], help="Request rate the endpoint must sustain")
+    parser.add_argument("--target-p95-ms", type=float, default=DEFAULTS["target_p95_ms"], help="p95 latency the endpoint must stay under")
+    parser.add_argument("--json", help="Also write the summaries to this JSON file")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    if args.stream_overhead:
+        results = run_stream_overhead(args)
+        print_stream_overhead(results)
+    elif args.capacity:
+        results = plan_capacity(args)
+        print_capacity_plan(results)
+    else:
+        results = run_benchmark(args)
+        print_report(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
@@ -0,0 +1,193 @@
+"""
+Databricks REST client shared by deploy.py and destroy.py.
+
+Keeps idle keep-alive connections per host, retries throttled (429) and 5xx responses and
+connection errors with jittered exponential backoff (honoring Retry-After, up to the backoff
+cap), follows next_page_token pagination, and records the latency of every HTTP call. Plain
+http:// hosts are accepted so the client can be pointed at a local stub server.
+"""
+
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+from email.utils import parsedate_to_datetime
+
+ACCOUNTS_HOST = "https://accounts.azuredatabricks.net"
+DEFAULT_TIMEOUT_SECONDS = 30
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_POOL_SIZE = 4
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses meaning the server did not process the request, so even non-idempotent calls retry
+UNPROCESSED_STATUSES = {429, 503}
+# Methods safe to resend after a connection error that may have reached the server
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+
+class DatabricksApiError(RuntimeError):
+    def __init__(self, status, detail):
+        super().__init__(f"Databricks API error {status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+def normalize_databricks_host(host):
+    if not host:
+        return host
+    return host if host.startswith(("https://", "http://")) else f"https://{host}"
+
+
+def retry_after_seconds(value):
+    """Parses a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class DatabricksClient:
+    def __init__(
+        self,
+        timeout=DEFAULT_TIMEOUT_SECONDS,
+        max_retries=DEFAULT_MAX_RETRIES,
+        pool_size=DEFAULT_POOL_SIZE,
+        sleep=time.sleep,
+        on_call=None,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.sleep = sleep
+        # Optional on_call(method, path, status, started, seconds) hook, run in the calling thread.
+        self.on_call = on_call
+        # (method, path, status, seconds) per HTTP call; status is None when the connection failed.
+        self.calls = []
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, scheme, netloc, reuse=True):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle and reuse:
+                return idle.pop()
+        connection_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_cls(netloc, timeout=self.timeout)
+
+    def _release(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _record(self, method, path, status, started):
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self.calls.append((method, path, status, seconds))
+        if self.on_call is not None:
+            self.on_call(method, path, status, started, seconds)
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt))
+        if retry_after is not None:
+            delay = min(BACKOFF_MAX_SECONDS, retry_after) + random.uniform(0, BACKOFF_BASE_SECONDS)
+        self.sleep(delay)
+
+    def request(self, host, token, method, path, payload=None, params=None, idempotent=None):
+        """
+        Sends one API call and returns the decoded JSON body. Idempotent calls (by method, unless
+        `idempotent` says otherwise) are retried on any RETRY_STATUSES response or connection
+        error. Other calls are retried only when the server cannot have processed them: a 429 or
+        503 response, or a connection that could not be opened. They also use a fresh connection,
+        so a stale keep-alive socket cannot fail them after sending.
+        """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        parsed = urllib.parse.urlsplit(normalize_databricks_host(host).rstrip("/"))
+        target = f"{parsed.path}{path}"
+        if params:
+            target += ("&" if "?" in target else "?") + urllib.parse.urlencode(params)
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+        for attempt in range(self.max_retries + 1):
+            conn = self._acquire(parsed.scheme, parsed.netloc, reuse=idempotent)
+            started = time.perf_counter()
+            sent = False
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                sent = True
+                conn.request(method, target, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                self._record(method, path, None, started)
+                if attempt == self.max_retries or (sent and not idempotent):
+                    raise
+                self._backoff(attempt)
+                continue
+            self._record(method, path, response.status, started)
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(parsed.scheme, parsed.netloc, conn)
+
+            retryable = idempotent or response.status in UNPROCESSED_STATUSES
+            if response.status in RETRY_STATUSES and retryable and attempt < self.max_retries:
+                self._backoff(attempt, retry_after_seconds(response.getheader("Retry-After")))
+                continue
+            if response.status >= 400:
+                raise DatabricksApiError(response.status, data.decode("utf-8", errors="replace"))
+            return json.loads(data) if data else {}
+
+    def paginate(self, host, token, path, items_key, params=None):
+        """Yields items_key entries of a GET list endpoint, following next_page_token."""
+        params = dict(params or {})
+        while True:
+            response = self.request(host, token, "GET", path, params=params)
+            if isinstance(response, list):
+                yield from response
+                return
+            yield from response.get(items_key) or []
+            page_token = response.get("next_page_token")
+            if not page_token:
+                return
+            params["page_token"] = page_token
+
+    def account_request(self, account_id, token, method, path, payload=None):
+        return self.request(ACCOUNTS_HOST, token, method, f"/api/2.0/accounts/{account_id}{path}", payload)
+
+    def account_paginate(self, account_id, token, path, items_key):
+        return self.paginate(ACCOUNTS_HOST, token, f"/api/2.0/accounts/{account_id}{path}", items_key)
+
+    def latency_summary(self):
+        """Per "METHOD path" call count, total and max seconds."""
+        summary = {}
+        with self._lock:
+            calls = list(self.calls)
+        for method, path, _, seconds in calls:
+            entry = summary.setdefault(f"{method} {path}", {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            entry["calls"] += 1
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+        return summary
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
@@ -1,12 +1,23 @@
 import argparse
+import base64
+import hashlib
 import json
+import os
+import platform
+import re
 import shutil
 import subprocess
 import sys
-import urllib.error
-import urllib.request
+import threading
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
 from pathlib import Path
 
+from databricks_client import DatabricksApiError, DatabricksClient, normalize_databricks_host
+from run_timer import RunTimer
+
 DEFAULTS = {
     "resource_group_name_prefix": "rg-dbgenai",
     "location": "eastus2",
@@ -31,8 +42,14 @@ DEFAULTS = {
     "serving_workload_type": "CPU",
     "serving_workload_size": "Small",
     "serving_scale_to_zero_enabled": True,
+    "serving_candidate_model_version": None,
+    "serving_candidate_traffic_percentage": 10,
 }
 
+# Catalog/schema the driver notebook registered the model under, keyed by workspace host;
+# written by uc_target.py next to the notebook in workspace_base_path
+UC_TARGET_FILE_NAME = "uc_target.json"
+
 ENV_KEYS = [
     "DATABRICKS_WORKSPACE_URL",
 ]
@@ -56,15 +73,86 @@ def find_az():
 
 AZ_BIN = find_az()
 
-
-def run(cmd):
-    print(f"\n$ {' '.join(cmd)}")
-    subprocess.check_call(cmd)
-
-
-def run_capture(cmd):
-    print(f"\n$ {' '.join(cmd)}")
-    return subprocess.check_output(cmd, text=True).strip()
+DEFAULT_JOBS = 3
+FULL_DEPLOY_STACKS = [
+    "01_resource_group",
+    "02_databricks_workspace",
+    "03_uc_metastore_assignment",
+    "04_databricks_compute",
+    "05_notebooks",
+    "06_job",
+]
+# Stacks whose generated terraform.tfvars need another stack's outputs. Dependencies through
+# terraform_remote_state are discovered from the .tf files.
+STACK_INPUT_DEPENDENCIES = {
+    "02_databricks_workspace": ["01_resource_group"],
+    "03_uc_metastore_assignment": ["02_databricks_workspace"],
+    "04_databricks_compute": ["01_resource_group"],
+    "05_notebooks": ["01_resource_group"],
+    "06_job": ["01_resource_group"],
+    "07_model_serving_endpoint": ["01_resource_group"],
+}
+REMOTE_STATE_PATH_RE = re.compile(r'path\s*=\s*"\.\./([^/"]+)/terraform\.tfstate"')
+# Each stack records the hash of its inputs after a successful apply; a later deploy with the
+# same hash skips the stack. Files outside the stack dir that a stack reads are listed here
+# (globs relative to the repo root).
+DEPLOY_MANIFEST_NAME = ".deploy-manifest.json"
+STACK_EXTRA_INPUTS = {
+    "05_notebooks": ["notebooks/*.ipynb"],
+}
+# Provider binaries are shared by every stack through Terraform's plugin cache, once per
+# machine. Stacks without a lock file are seeded with the provider entries other stacks
+# already locked, so init can link providers from the cache instead of downloading them.
+DEFAULT_PLUGIN_CACHE_DIR = Path.home() / ".terraform.d" / "plugin-cache"
+LOCK_FILE_NAME = ".terraform.lock.hcl"
+LOCK_FILE_HEADER = (
+    "# This file is maintained automatically by \"terraform init\".\n"
+    "# Manual edits may be lost in future updates.\n"
+)
+REQUIRED_PROVIDER_RE = re.compile(r'source\s*=\s*"([^"]+)"\s*\n\s*version\s*=\s*"([^"]+)"')
+LOCK_PROVIDER_RE = re.compile(r'^provider "([^"]+)" \{\n.*?^\}\n', re.M | re.S)
+PRINT_LOCK = threading.Lock()
+# In-process caches: az access tokens keyed on resource (reused until shortly before they
+# expire) and `terraform output -json` results keyed on stack dir (dropped after an apply).
+TOKEN_EXPIRY_MARGIN_SECONDS = 300
+TOKEN_CACHE = {}
+TOKEN_CACHE_LOCK = threading.Lock()
+OUTPUT_CACHE = {}
+OUTPUT_CACHE_LOCK = threading.Lock()
+TIMER = RunTimer("deploy")
+DATABRICKS_CLIENT = DatabricksClient(on_call=TIMER.record_http)
+
+
+def log(message, prefix=None):
+    with PRINT_LOCK:
+        print(f"[{prefix}] {message}" if prefix else message, flush=True)
+
+
+def run(cmd, prefix=None):
+    if prefix is None:
+        print(f"\n$ {' '.join(cmd)}")
+        with TIMER.command(cmd):
+            subprocess.check_call(cmd)
+        return
+    log(f"$ {' '.join(cmd)}", prefix)
+    with TIMER.command(cmd):
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding="utf-8", errors="replace"
+        )
+        for line in proc.stdout:
+            log(line.rstrip(), prefix)
+        returncode = proc.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def run_capture(cmd, prefix=None):
+    if prefix is None:
+        print(f"\n$ {' '.join(cmd)}")
+    else:
+        log(f"$ {' '.join(cmd)}", prefix)
+    with TIMER.command(cmd):
+        return subprocess.check_output(cmd, text=True).strip()
 
 
 def hcl_value(value):
@@ -83,62 +171,301 @@ def write_tfvars(path, items):
     path.write_text("\n".join(lines) + "\n", encoding="utf-8")
 
 
-def get_output(tf_dir, output_name):
-    return run_capture(["terraform", f"-chdir={tf_dir}", "output", "-raw", output_name])
+def get_outputs(tf_dir, prefix=None):
+    """Returns all outputs of a stack as {name: value}, read with one `terraform output -json` call."""
+    key = Path(tf_dir).resolve()
+    with OUTPUT_CACHE_LOCK:
+        if key in OUTPUT_CACHE:
+            return OUTPUT_CACHE[key]
+    raw = json.loads(run_capture(["terraform", f"-chdir={tf_dir}", "output", "-json"], prefix) or "{}")
+    outputs = {name: output.get("value") for name, output in raw.items()}
+    with OUTPUT_CACHE_LOCK:
+        OUTPUT_CACHE[key] = outputs
+    return outputs
 
 
-def normalize_databricks_host(host):
-    if not host:
-        return host
-    return host if host.startswith("https://") else f"https://{host}"
+def invalidate_outputs(tf_dir):
+    with OUTPUT_CACHE_LOCK:
+        OUTPUT_CACHE.pop(Path(tf_dir).resolve(), None)
 
 
-def databricks_api(host, token, method, path, payload=None):
-    url = f"{normalize_databricks_host(host).rstrip('/')}{path}"
-    data = None
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method=method)
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        with urllib.request.urlopen(req) as resp:
-            return json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as exc:
-        detail = exc.read().decode("utf-8")
-        raise RuntimeError(f"Databricks API error {exc.code}: {detail}") from exc
+def get_output(tf_dir, output_name, prefix=None):
+    outputs = get_outputs(tf_dir, prefix)
+    if output_name not in outputs:
+        raise RuntimeError(f"Terraform output {output_name} not found in {tf_dir}.")
+    value = outputs[output_name]
+    return value if isinstance(value, str) else json.dumps(value)
 
 
-def databricks_account_api(account_id, token, method, path, payload=None):
-    base = "https://accounts.azuredatabricks.net"
-    return databricks_api(base, token, method, f"/api/2.0/accounts/{account_id}{path}", payload)
+def remote_state_dependencies(tf_dir):
+    dependencies = set()
+    for tf_file in tf_dir.glob("*.tf"):
+        dependencies.update(REMOTE_STATE_PATH_RE.findall(tf_file.read_text(encoding="utf-8")))
+    return dependencies
 
 
-def get_databricks_aad_token():
+def read_json_file(path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def read_state_outputs(tf_dir):
+    outputs = read_json_file(tf_dir / "terraform.tfstate").get("outputs", {})
+    return {name: output.get("value") for name, output in outputs.items()}
+
+
+def hash_files(digest, paths, root):
+    for path in sorted(paths):
+        if path.is_file():
+            digest.update(path.relative_to(root).as_posix().encode("utf-8") + b"\0")
+            digest.update(path.read_bytes() + b"\0")
+
+
+def stack_fingerprint(tf_dir):
+    """
+    Returns {"init": ..., "apply": ...} content hashes for a stack. The init hash covers the .tf
+    files and provider lock file; the apply hash adds terraform.tfvars, any STACK_EXTRA_INPUTS
+    and the outputs of stacks read through terraform_remote_state.
+    """
+    repo_root = tf_dir.parent.parent
+    init_digest = hashlib.sha256()
+    hash_files(init_digest, [*tf_dir.glob("*.tf"), tf_dir / ".terraform.lock.hcl"], repo_root)
+    apply_digest = hashlib.sha256(init_digest.digest())
+    hash_files(apply_digest, [tf_dir / "terraform.tfvars"], repo_root)
+    for pattern in STACK_EXTRA_INPUTS.get(tf_dir.name, []):
+        hash_files(apply_digest, repo_root.glob(pattern), repo_root)
+    for dependency in sorted(remote_state_dependencies(tf_dir)):
+        upstream_outputs = read_state_outputs(tf_dir.parent / dependency)
+        apply_digest.update(json.dumps([dependency, upstream_outputs], sort_keys=True).encode("utf-8"))
+    return {"init": init_digest.hexdigest(), "apply": apply_digest.hexdigest()}
+
+
+def write_deploy_manifest(tf_dir, **hashes):
+    manifest_path = tf_dir / DEPLOY_MANIFEST_NAME
+    manifest = read_json_file(manifest_path)
+    manifest.update(hashes)
+    manifest_path.write_text(json.dumps(manifest, indent=2) + "\n", encoding="utf-8")
+
+
+def init_is_current(tf_dir):
+    manifest = read_json_file(tf_dir / DEPLOY_MANIFEST_NAME)
+    current = manifest.get("init") == stack_fingerprint(tf_dir)["init"]
+    return current and (tf_dir / ".terraform").is_dir()
+
+
+def init_stack(tf_dir, prefix=None, force=False):
+    """Runs terraform init unless .terraform exists and the .tf files and lock file are unchanged."""
+    if init_is_current(tf_dir) and not force:
+        log(f"terraform init is current for {tf_dir.name}; skipping.", prefix)
+        return
+    run(["terraform", f"-chdir={tf_dir}", "init", "-input=false"], prefix)
+    write_deploy_manifest(tf_dir, init=stack_fingerprint(tf_dir)["init"])
+
+
+def provider_address(source):
+    """Expands a required_providers source (e.g. hashicorp/azurerm) to its full registry address."""
+    parts = source.lower().split("/")
+    if len(parts) == 2:
+        parts.insert(0, "registry.terraform.io")
+    return "/".join(parts)
+
+
+def required_providers(tf_dir):
+    """Maps each provider the stack requires (full address) to its version constraint."""
+    providers = {}
+    for tf_file in sorted(tf_dir.glob("*.tf")):
+        for source, constraint in REQUIRED_PROVIDER_RE.findall(tf_file.read_text(encoding="utf-8")):
+            providers[provider_address(source)] = constraint
+    return providers
+
+
+def read_lock_blocks(tf_dir):
+    """Maps provider address to its provider block in the stack's lock file."""
+    lock_path = tf_dir / LOCK_FILE_NAME
+    if not lock_path.is_file():
+        return {}
+    text = lock_path.read_text(encoding="utf-8")
+    return {match.group(1): match.group(0) for match in LOCK_PROVIDER_RE.finditer(text)}
+
+
+def lock_block_field(block, field):
+    match = re.search(rf'^\s*{field}\s*=\s*"([^"]+)"', block, re.M)
+    return match.group(1) if match else None
+
+
+def terraform_platform():
+    machine = platform.machine().lower()
+    arch = {"x86_64": "amd64", "amd64": "amd64", "aarch64": "arm64", "arm64": "arm64"}.get(machine, machine)
+    return f"{platform.system().lower()}_{arch}"
+
+
+def providers_cached(tf_dir, plugin_cache_dir):
+    """True when every provider the stack requires is locked and unpacked in the plugin cache."""
+    locked = read_lock_blocks(tf_dir)
+    for address in required_providers(tf_dir):
+        version = lock_block_field(locked[address], "version") if address in locked else None
+        if version is None or not (plugin_cache_dir / address / version / terraform_platform()).is_dir():
+            return False
+    return True
+
+
+def seed_lock_file(tf_dir, known_blocks):
+    """
+    Writes a lock file for a stack that has none from provider blocks locked by other stacks,
+    when all of its providers are covered with the same version constraint. Returns True if written.
+    """
+    lock_path = tf_dir / LOCK_FILE_NAME
+    if lock_path.exists():
+        return False
+    blocks = []
+    for address, constraint in sorted(required_providers(tf_dir).items()):
+        block = known_blocks.get(address)
+        if block is None or lock_block_field(block, "constraints") != constraint:
+            return False
+        blocks.append(block)
+    lock_path.write_text(LOCK_FILE_HEADER + "".join(f"\n{block}" for block in blocks), encoding="utf-8")
+    return True
+
+
+def init_stacks(tf_dirs, plugin_cache_dir, jobs=DEFAULT_JOBS, force=False):
+    """
+    Inits every stack about to be deployed before any apply runs. Stacks whose providers are
+    not yet in the plugin cache are inited one at a time, because the cache is not safe for
+    concurrent writers; each one extends the lock entries used to seed the rest. The remaining
+    stacks only link cached providers and are inited concurrently.
+    """
+    pending = [tf_dir for tf_dir in tf_dirs if force or not init_is_current(tf_dir)]
+    for tf_dir in tf_dirs:
+        if tf_dir not in pending:
+            log(f"terraform init is current for {tf_dir.name}; skipping.")
+    known_blocks = {}
+    for tf_dir in tf_dirs:
+        for address, block in read_lock_blocks(tf_dir).items():
+            known_blocks.setdefault(address, block)
+
+    cached = []
+    for tf_dir in pending:
+        if seed_lock_file(tf_dir, known_blocks):
+            log(f"Seeded {LOCK_FILE_NAME} for {tf_dir.name} from the other stacks' lock files.")
+        if providers_cached(tf_dir, plugin_cache_dir):
+            cached.append(tf_dir)
+            continue
+        init_stack(tf_dir, force=True)
+        for address, block in read_lock_blocks(tf_dir).items():
+            known_blocks.setdefault(address, block)
+
+    if cached:
+        workers = min(jobs, len(cached))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(init_stack, tf_dir, tf_dir.name if workers > 1 else None, True) for tf_dir in cached
+            ]
+            for future in futures:
+                future.result()
+
+
+def apply_stack(tf_dir, prefix=None, force=False):
+    """Applies a stack unless its inputs match the last successful apply. Returns True if applied."""
+    manifest = read_json_file(tf_dir / DEPLOY_MANIFEST_NAME)
+    unchanged = manifest.get("apply") == stack_fingerprint(tf_dir)["apply"]
+    has_state = bool(read_json_file(tf_dir / "terraform.tfstate").get("resources"))
+    if unchanged and has_state and not force:
+        log(f"No input changes for {tf_dir.name} since the last apply; skipping (use --force to re-apply).", prefix)
+        return False
+    # A forced re-init already happened in init_stacks
+    init_stack(tf_dir, prefix)
+    run(["terraform", f"-chdir={tf_dir}", "apply", "-auto-approve"], prefix)
+    invalidate_outputs(tf_dir)
+    write_deploy_manifest(tf_dir, **stack_fingerprint(tf_dir))
+    return True
+
+
+def build_stack_graph(terraform_root, stack_names):
+    """Maps each stack to the selected stacks it depends on (remote state reads plus tfvars inputs)."""
+    graph = {}
+    for name in stack_names:
+        dependencies = remote_state_dependencies(terraform_root / name)
+        dependencies.update(STACK_INPUT_DEPENDENCIES.get(name, []))
+        graph[name] = sorted(dep for dep in dependencies if dep in stack_names and dep != name)
+    return graph
+
+
+def run_stack_task(task, name, prefix):
+    with TIMER.stack(name):
+        return task(prefix)
+
+
+def run_stack_graph(graph, tasks, jobs):
+    """
+    Runs tasks[name](prefix) for every stack once its dependencies have succeeded, up to `jobs`
+    at a time. After the first failure no further stacks start; stacks already applying are
+    allowed to finish so their state is not left locked, then the first error is raised.
+    """
+    pending = list(graph)
+    running = {}
+    done = set()
+    first_error = None
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            if first_error is None:
+                for name in [n for n in pending if all(dep in done for dep in graph[n])]:
+                    if len(running) >= jobs:
+                        break
+                    pending.remove(name)
+                    prefix = name if jobs > 1 else None
+                    running[pool.submit(run_stack_task, tasks[name], name, prefix)] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    applied = future.result()
+                except Exception as exc:
+                    log(f"Stack failed: {exc}", name)
+                    if first_error is None:
+                        first_error = exc
+                else:
+                    done.add(name)
+                    log("Stack applied." if applied is not False else "Stack unchanged.", name)
+    if first_error is not None:
+        raise first_error
+    if pending:
+        raise RuntimeError(f"Dependency cycle between stacks: {', '.join(pending)}")
+
+
+def token_expiry(token):
+    """Expiry of an `az account get-access-token` response as a Unix timestamp (0 if unknown)."""
+    if token.get("expires_on"):
+        return float(token["expires_on"])
+    if token.get("expiresOn"):
+        # Older Azure CLI versions only report local time, e.g. "2024-05-01 12:34:56.000000".
+        return datetime.strptime(token["expiresOn"], "%Y-%m-%d %H:%M:%S.%f").timestamp()
+    return 0
+
+
+def get_access_token(resource, prefix=None):
     if AZ_BIN is None:
         raise FileNotFoundError("Azure CLI not found. Install Azure CLI or ensure az is on PATH.")
-    return run_capture(
-        [
-            AZ_BIN,
-            "account",
-            "get-access-token",
-            "--resource",
-            DATABRICKS_SP_APP_ID,
-            "--query",
-            "accessToken",
-            "-o",
-            "tsv",
-        ]
-    )
+    with TOKEN_CACHE_LOCK:
+        cached = TOKEN_CACHE.get(resource)
+        if cached and cached[1] - TOKEN_EXPIRY_MARGIN_SECONDS > time.time():
+            return cached[0]
+        token = json.loads(
+            run_capture([AZ_BIN, "account", "get-access-token", "--resource", resource, "-o", "json"], prefix)
+        )
+        TOKEN_CACHE[resource] = (token["accessToken"], token_expiry(token))
+        return token["accessToken"]
+
+
+def get_databricks_aad_token(prefix=None):
+    return get_access_token(DATABRICKS_SP_APP_ID, prefix)
 
 
 def get_workspace_id(account_id, token, workspace_name):
-    response = databricks_account_api(account_id, token, "GET", "/workspaces")
-    if isinstance(response, list):
-        workspaces = response
-    else:
-        workspaces = response.get("workspaces", [])
-    for workspace in workspaces or []:
+    for workspace in DATABRICKS_CLIENT.account_paginate(account_id, token, "/workspaces", "workspaces"):
         if workspace.get("workspace_name") == workspace_name:
             return workspace.get("workspace_id")
     return None
@@ -149,12 +476,7 @@ def get_metastore_id(account_id, token, metastore_name_or_id):
         return None
     if len(metastore_name_or_id) == 36 and metastore_name_or_id.count("-") == 4:
         return metastore_name_or_id
-    response = databricks_account_api(account_id, token, "GET", "/metastores")
-    if isinstance(response, list):
-        metastores = response
-    else:
-        metastores = response.get("metastores", [])
-    for metastore in metastores or []:
+    for metastore in DATABRICKS_CLIENT.account_paginate(account_id, token, "/metastores", "metastores"):
         if metastore.get("name") == metastore_name_or_id:
             return metastore.get("metastore_id")
     return None
@@ -209,8 +531,8 @@ def write_databricks_tfvars(databricks_dir, rg_name):
     write_tfvars(databricks_dir / "terraform.tfvars", items)
 
 
-def write_metastore_tfvars(metastore_dir, workspace_id):
-    token = get_databricks_aad_token()
+def write_metastore_tfvars(metastore_dir, workspace_id, prefix=None):
+    token = get_databricks_aad_token(prefix)
     metastore_id = get_metastore_id(
         DEFAULTS["account_id"],
         token,
@@ -256,23 +578,151 @@ def write_job_tfvars(job_dir, rg_name):
     write_tfvars(job_dir / "terraform.tfvars", items)
 
 
-def write_serving_tfvars(serving_dir, rg_name):
+def full_deploy_tasks(terraform_root, outputs, force=False):
+    """
+    Per-stack deploy steps for a full deploy; each reads and records stack outputs in `outputs`
+    and returns whether the stack was applied (False when skipped as unchanged).
+    """
+    rg_dir = terraform_root / "01_resource_group"
+    databricks_dir = terraform_root / "02_databricks_workspace"
+    metastore_dir = terraform_root / "03_uc_metastore_assignment"
+    compute_dir = terraform_root / "04_databricks_compute"
+    notebooks_dir = terraform_root / "05_notebooks"
+    job_dir = terraform_root / "06_job"
+
+    def deploy_rg(prefix):
+        write_rg_tfvars(rg_dir)
+        applied = apply_stack(rg_dir, prefix, force)
+        outputs["rg_name"] = get_output(rg_dir, "resource_group_name", prefix)
+        return applied
+
+    def deploy_databricks(prefix):
+        write_databricks_tfvars(databricks_dir, outputs["rg_name"])
+        applied = apply_stack(databricks_dir, prefix, force)
+        outputs["workspace_url"] = get_output(databricks_dir, "databricks_workspace_url", prefix)
+        outputs["workspace_name"] = get_output(databricks_dir, "databricks_workspace_name", prefix)
+        return applied
+
+    def deploy_metastore(prefix):
+        token = get_databricks_aad_token(prefix)
+        workspace_id = get_workspace_id(DEFAULTS["account_id"], token, outputs["workspace_name"])
+        if workspace_id is None:
+            raise RuntimeError(f"Could not resolve workspace ID for {outputs['workspace_name']}.")
+        write_metastore_tfvars(metastore_dir, workspace_id, prefix)
+        return apply_stack(metastore_dir, prefix, force)
+
+    def deploy_compute(prefix):
+        write_compute_tfvars(compute_dir, outputs["rg_name"])
+        return apply_stack(compute_dir, prefix, force)
+
+    def deploy_notebooks(prefix):
+        write_notebooks_tfvars(notebooks_dir, outputs["rg_name"])
+        return apply_stack(notebooks_dir, prefix, force)
+
+    def deploy_job(prefix):
+        write_job_tfvars(job_dir, outputs["rg_name"])
+        return apply_stack(job_dir, prefix, force)
+
+    return {
+        "01_resource_group": deploy_rg,
+        "02_databricks_workspace": deploy_databricks,
+        "03_uc_metastore_assignment": deploy_metastore,
+        "04_databricks_compute": deploy_compute,
+        "05_notebooks": deploy_notebooks,
+        "06_job": deploy_job,
+    }
+
+
+def read_uc_target(workspace_url, prefix=None):
+    """Returns the (catalog, schema) recorded by the notebook's registration step, or None."""
+    path = f"{DEFAULTS['workspace_base_path']}/{UC_TARGET_FILE_NAME}"
+    try:
+        token = get_databricks_aad_token(prefix)
+        response = DATABRICKS_CLIENT.request(
+            workspace_url, token, "GET", "/api/2.0/workspace/export", params={"path": path, "format": "AUTO"}
+        )
+        targets = json.loads(base64.b64decode(response.get("content") or ""))
+    except (DatabricksApiError, subprocess.CalledProcessError, OSError, ValueError) as exc:
+        log(f"No UC target recorded at {path} ({exc}).", prefix)
+        return None
+    target = targets.get(urllib.parse.urlsplit(normalize_databricks_host(workspace_url)).netloc)
+    if not target:
+        log(f"{path} has no UC target for {workspace_url}.", prefix)
+        return None
+    log(f"Using UC target {target['catalog']}.{target['schema']} recorded by the notebook.", prefix)
+    return target["catalog"], target["schema"]
+
+
+def write_serving_tfvars(
+    serving_dir, rg_name, capacity=None, candidate_version=None, candidate_traffic=None, uc_target=None
+):
+    capacity = capacity or {}
+    # An explicit serving_catalog_name wins; otherwise use the notebook's recorded target, and only
+    # without one let the stack derive the catalog from the workspace name
+    catalog_name, schema_name = DEFAULTS["serving_catalog_name"], DEFAULTS["serving_schema_name"]
+    if catalog_name is None and uc_target is not None:
+        catalog_name, schema_name = uc_target
+    if candidate_version is None:
+        candidate_version = DEFAULTS["serving_candidate_model_version"]
+    if candidate_traffic is None:
+        candidate_traffic = DEFAULTS["serving_candidate_traffic_percentage"] if candidate_version else 0
     items = [
         ("resource_group_name", rg_name),
-        ("catalog_name", DEFAULTS["serving_catalog_name"]),
-        ("schema_name", DEFAULTS["serving_schema_name"]),
+        ("catalog_name", catalog_name),
+        ("schema_name", schema_name),
         ("model_name", DEFAULTS["serving_model_name"]),
         ("model_version", DEFAULTS["serving_model_version"]),
         ("endpoint_name", DEFAULTS["serving_endpoint_name"]),
         ("served_model_name", DEFAULTS["serving_served_model_name"]),
         ("workload_type", DEFAULTS["serving_workload_type"]),
-        ("workload_size", DEFAULTS["serving_workload_size"]),
-        ("scale_to_zero_enabled", DEFAULTS["serving_scale_to_zero_enabled"]),
+        ("workload_size", capacity.get("workload_size", DEFAULTS["serving_workload_size"])),
+        ("scale_to_zero_enabled", capacity.get("scale_to_zero_enabled", DEFAULTS["serving_scale_to_zero_enabled"])),
+        ("candidate_model_version", candidate_version),
+        ("candidate_traffic_percentage", candidate_traffic),
     ]
     write_tfvars(serving_dir / "terraform.tfvars", items)
 
 
+def plan_serving_capacity(report_path, target_qps, target_p95_ms, request_mix=None, stub_latencies=None):
+    """
+    Replays the request mix against a local stand-in of the served agent (the notebook's agent.py
+    with a stub LLM and fake UC functions) and returns the recommended serving capacity.
+    stub_latencies overrides the benchmark's assumed LLM/UC timings, e.g. {"llm_ttft_ms": 400}.
+    """
+    import benchmark_agent
+
+    bench_args = ["--target-qps", str(target_qps), "--target-p95-ms", str(target_p95_ms)]
+    if request_mix is not None:
+        bench_args += ["--request-mix", str(request_mix)]
+    for name, value in (stub_latencies or {}).items():
+        if value is not None:
+            bench_args += [f"--{name.replace('_', '-')}", str(value)]
+    with TIMER.stack("capacity_plan"):
+        plan = benchmark_agent.plan_capacity(benchmark_agent.build_parser().parse_args(bench_args))
+    benchmark_agent.print_capacity_plan(plan)
+    report_path.write_text(json.dumps(plan, indent=2) + "\n", encoding="utf-8")
+    print(f"Capacity plan written to {report_path}")
+    return plan["recommendation"]
+
+
+def read_capacity_plan(report_path, prefix=None):
+    """Returns the recommendation saved by an earlier --capacity-plan run, or None."""
+    recommendation = read_json_file(report_path).get("recommendation")
+    if not recommendation:
+        return None
+    log(
+        f"Using workload size {recommendation['workload_size']} and scale to zero "
+        f"{'on' if recommendation['scale_to_zero_enabled'] else 'off'} from {report_path.name} "
+        "(--capacity-plan re-plans; --workload-size/--scale-to-zero override).",
+        prefix,
+    )
+    return recommendation
+
+
 if __name__ == "__main__":
+    timing_report = None
+    graph = None
+    ok = False
     try:
         parser = argparse.ArgumentParser(description="Deploy Terraform stacks for Databricks GenAI Agents.")
         group = parser.add_mutually_exclusive_group()
@@ -283,7 +733,95 @@ if __name__ == "__main__":
         group.add_argument("--notebooks-only", action="store_true", help="Deploy only the notebooks stack")
         group.add_argument("--job-only", action="store_true", help="Deploy only the Databricks job stack")
         group.add_argument("--serving-only", action="store_true", help="Deploy only the model serving endpoint stack")
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=DEFAULT_JOBS,
+            help=f"Stacks to apply concurrently during a full deploy (default {DEFAULT_JOBS}; 1 = sequential)",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Run terraform init and apply for every selected stack, even if its inputs are unchanged",
+        )
+        parser.add_argument(
+            "--plugin-cache-dir",
+            type=Path,
+            default=Path(os.environ.get("TF_PLUGIN_CACHE_DIR") or DEFAULT_PLUGIN_CACHE_DIR),
+            help="Terraform provider plugin cache shared by all stacks "
+            "(default $TF_PLUGIN_CACHE_DIR or ~/.terraform.d/plugin-cache)",
+        )
+        parser.add_argument(
+            "--capacity-plan",
+            action="store_true",
+            help="With --serving-only: benchmark the agent locally and size the endpoint "
+            "for --target-qps and --target-p95-ms. The plan is saved to .serving-capacity.json and reused "
+            "by later --serving-only runs",
+        )
+        parser.add_argument("--target-qps", type=float, default=5.0, help="Request rate the endpoint must sustain")
+        parser.add_argument("--target-p95-ms", type=float, default=5000, help="p95 latency to stay under")
+        parser.add_argument("--request-mix", type=Path, help="Recorded requests (JSONL) for --capacity-plan")
+        parser.add_argument(
+            "--llm-ttft-ms",
+            type=float,
+            help="LLM time to first token assumed by --capacity-plan (default: benchmark_agent.py's 150)",
+        )
+        parser.add_argument(
+            "--llm-token-ms",
+            type=float,
+            help="LLM delay per streamed chunk assumed by --capacity-plan (default: benchmark_agent.py's 10)",
+        )
+        parser.add_argument(
+            "--uc-latency-ms",
+            type=float,
+            help="UC function latency assumed by --capacity-plan (default: benchmark_agent.py's 250)",
+        )
+        parser.add_argument(
+            "--workload-size",
+            choices=["Small", "Medium", "Large"],
+            help="With --serving-only: serving workload size, overriding .serving-capacity.json",
+        )
+        parser.add_argument(
+            "--scale-to-zero",
+            action=argparse.BooleanOptionalAction,
+            help="With --serving-only: enable or disable scale to zero, overriding .serving-capacity.json",
+        )
+        parser.add_argument(
+            "--candidate-model-version",
+            help="With --serving-only: also serve this model version alongside the primary one",
+        )
+        parser.add_argument(
+            "--candidate-traffic",
+            type=int,
+            help="Percentage of traffic routed to --candidate-model-version (0-100)",
+        )
+        parser.add_argument(
+            "--timing-report",
+            type=Path,
+            help="Where to write the JSON timing report (default .deploy-timing.json in the repo root)",
+        )
         args = parser.parse_args()
+        if args.jobs < 1:
+            parser.error("--jobs must be at least 1")
+        serving_flags = (
+            args.capacity_plan or args.candidate_model_version or args.workload_size or args.scale_to_zero is not None
+        )
+        if serving_flags and not args.serving_only:
+            parser.error(
+                "--capacity-plan, --candidate-model-version, --workload-size and --scale-to-zero require --serving-only"
+            )
+        stub_latencies = {
+            "llm_ttft_ms": args.llm_ttft_ms,
+            "llm_token_ms": args.llm_token_ms,
+            "uc_latency_ms": args.uc_latency_ms,
+        }
+        if any(value is not None for value in stub_latencies.values()) and not args.capacity_plan:
+            parser.error("--llm-ttft-ms, --llm-token-ms and --uc-latency-ms require --capacity-plan")
+        if args.candidate_traffic is not None:
+            if not args.candidate_model_version:
+                parser.error("--candidate-traffic requires --candidate-model-version")
+            if not 0 <= args.candidate_traffic <= 100:
+                parser.error("--candidate-traffic must be between 0 and 100")
 
         repo_root = Path(__file__).resolve().parent.parent
         rg_dir = repo_root / "terraform" / "01_resource_group"
@@ -293,98 +831,114 @@ if __name__ == "__main__":
         notebooks_dir = repo_root / "terraform" / "05_notebooks"
         job_dir = repo_root / "terraform" / "06_job"
         serving_dir = repo_root / "terraform" / "07_model_serving_endpoint"
+        timing_report = args.timing_report or repo_root / ".deploy-timing.json"
 
+        # Stacks each mode inits: the ones it applies plus the ones whose outputs it reads
         if args.rg_only:
-            write_rg_tfvars(rg_dir)
-            run(["terraform", f"-chdir={rg_dir}", "init"])
-            run(["terraform", f"-chdir={rg_dir}", "apply", "-auto-approve"])
-            sys.exit(0)
-
-        if args.databricks_only:
-            run(["terraform", f"-chdir={rg_dir}", "init"])
-            rg_name = get_output(rg_dir, "resource_group_name")
-            write_databricks_tfvars(databricks_dir, rg_name)
-            run(["terraform", f"-chdir={databricks_dir}", "init"])
-            run(["terraform", f"-chdir={databricks_dir}", "apply", "-auto-approve"])
-            workspace_url = get_output(databricks_dir, "databricks_workspace_url")
-            write_env_file(repo_root, workspace_url=workspace_url)
-            sys.exit(0)
-
-        if args.metastore_only:
-            run(["terraform", f"-chdir={databricks_dir}", "init"])
-            workspace_name = get_output(databricks_dir, "databricks_workspace_name")
-            token = get_databricks_aad_token()
-            workspace_id = get_workspace_id(DEFAULTS["account_id"], token, workspace_name)
-            if workspace_id is None:
-                raise RuntimeError(f"Could not resolve workspace ID for {workspace_name}.")
-            write_metastore_tfvars(metastore_dir, workspace_id)
-            run(["terraform", f"-chdir={metastore_dir}", "init"])
-            run(["terraform", f"-chdir={metastore_dir}", "apply", "-auto-approve"])
-            sys.exit(0)
-
-        if args.compute_only:
-            run(["terraform", f"-chdir={rg_dir}", "init"])
-            rg_name = get_output(rg_dir, "resource_group_name")
-            write_compute_tfvars(compute_dir, rg_name)
-            run(["terraform", f"-chdir={compute_dir}", "init"])
-            run(["terraform", f"-chdir={compute_dir}", "apply", "-auto-approve"])
-            sys.exit(0)
-
-        if args.notebooks_only:
-            run(["terraform", f"-chdir={rg_dir}", "init"])
-            rg_name = get_output(rg_dir, "resource_group_name")
-            write_notebooks_tfvars(notebooks_dir, rg_name)
-            run(["terraform", f"-chdir={notebooks_dir}", "init"])
-            run(["terraform", f"-chdir={notebooks_dir}", "apply", "-auto-approve"])
-            sys.exit(0)
-
-        if args.job_only:
-            run(["terraform", f"-chdir={rg_dir}", "init"])
-            rg_name = get_output(rg_dir, "resource_group_name")
-            write_job_tfvars(job_dir, rg_name)
-            run(["terraform", f"-chdir={job_dir}", "init"])
-            run(["terraform", f"-chdir={job_dir}", "apply", "-auto-approve"])
-            sys.exit(0)
-
-        if args.serving_only:
-            run(["terraform", f"-chdir={rg_dir}", "init"])
-            rg_name = get_output(rg_dir, "resource_group_name")
-            write_serving_tfvars(serving_dir, rg_name)
-            run(["terraform", f"-chdir={serving_dir}", "init"])
-            run(["terraform", f"-chdir={serving_dir}", "apply", "-auto-approve"])
-            sys.exit(0)
+            init_dirs = [rg_dir]
+        elif args.databricks_only:
+            init_dirs = [rg_dir, databricks_dir]
+        elif args.metastore_only:
+            init_dirs = [databricks_dir, metastore_dir]
+        elif args.compute_only:
+            init_dirs = [rg_dir, compute_dir]
+        elif args.notebooks_only:
+            init_dirs = [rg_dir, notebooks_dir]
+        elif args.job_only:
+            init_dirs = [rg_dir, job_dir]
+        elif args.serving_only:
+            init_dirs = [rg_dir, serving_dir]
+        else:
+            init_dirs = [repo_root / "terraform" / name for name in FULL_DEPLOY_STACKS]
+        args.plugin_cache_dir.mkdir(parents=True, exist_ok=True)
+        os.environ["TF_PLUGIN_CACHE_DIR"] = str(args.plugin_cache_dir)
+        with TIMER.stack("terraform_init"):
+            init_stacks(init_dirs, args.plugin_cache_dir, args.jobs, args.force)
 
-        write_rg_tfvars(rg_dir)
-        run(["terraform", f"-chdir={rg_dir}", "init"])
-        run(["terraform", f"-chdir={rg_dir}", "apply", "-auto-approve"])
-        rg_name = get_output(rg_dir, "resource_group_name")
-
-        write_databricks_tfvars(databricks_dir, rg_name)
-        run(["terraform", f"-chdir={databricks_dir}", "init"])
-        run(["terraform", f"-chdir={databricks_dir}", "apply", "-auto-approve"])
-        workspace_url = get_output(databricks_dir, "databricks_workspace_url")
-        workspace_name = get_output(databricks_dir, "databricks_workspace_name")
-
-        token = get_databricks_aad_token()
-        workspace_id = get_workspace_id(DEFAULTS["account_id"], token, workspace_name)
-        if workspace_id is None:
-            raise RuntimeError(f"Could not resolve workspace ID for {workspace_name}.")
-        write_metastore_tfvars(metastore_dir, workspace_id)
-        run(["terraform", f"-chdir={metastore_dir}", "init"])
-        run(["terraform", f"-chdir={metastore_dir}", "apply", "-auto-approve"])
-
-        write_compute_tfvars(compute_dir, rg_name)
-        run(["terraform", f"-chdir={compute_dir}", "init"])
-        run(["terraform", f"-chdir={compute_dir}", "apply", "-auto-approve"])
-
-        write_notebooks_tfvars(notebooks_dir, rg_name)
-        run(["terraform", f"-chdir={notebooks_dir}", "init"])
-        run(["terraform", f"-chdir={notebooks_dir}", "apply", "-auto-approve"])
-
-        write_job_tfvars(job_dir, rg_name)
-        run(["terraform", f"-chdir={job_dir}", "init"])
-        run(["terraform", f"-chdir={job_dir}", "apply", "-auto-approve"])
-        write_env_file(repo_root, workspace_url=workspace_url)
+        if args.rg_only:
+            with TIMER.stack(rg_dir.name):
+                write_rg_tfvars(rg_dir)
+                apply_stack(rg_dir, force=args.force)
+
+        elif args.databricks_only:
+            with TIMER.stack(databricks_dir.name):
+                rg_name = get_output(rg_dir, "resource_group_name")
+                write_databricks_tfvars(databricks_dir, rg_name)
+                apply_stack(databricks_dir, force=args.force)
+                workspace_url = get_output(databricks_dir, "databricks_workspace_url")
+                write_env_file(repo_root, workspace_url=workspace_url)
+
+        elif args.metastore_only:
+            with TIMER.stack(metastore_dir.name):
+                workspace_name = get_output(databricks_dir, "databricks_workspace_name")
+                token = get_databricks_aad_token()
+                workspace_id = get_workspace_id(DEFAULTS["account_id"], token, workspace_name)
+                if workspace_id is None:
+                    raise RuntimeError(f"Could not resolve workspace ID for {workspace_name}.")
+                write_metastore_tfvars(metastore_dir, workspace_id)
+                apply_stack(metastore_dir, force=args.force)
+
+        elif args.compute_only:
+            with TIMER.stack(compute_dir.name):
+                rg_name = get_output(rg_dir, "resource_group_name")
+                write_compute_tfvars(compute_dir, rg_name)
+                apply_stack(compute_dir, force=args.force)
+
+        elif args.notebooks_only:
+            with TIMER.stack(notebooks_dir.name):
+                rg_name = get_output(rg_dir, "resource_group_name")
+                write_notebooks_tfvars(notebooks_dir, rg_name)
+                apply_stack(notebooks_dir, force=args.force)
+
+        elif args.job_only:
+            with TIMER.stack(job_dir.name):
+                rg_name = get_output(rg_dir, "resource_group_name")
+                write_job_tfvars(job_dir, rg_name)
+                apply_stack(job_dir, force=args.force)
+
+        elif args.serving_only:
+            capacity_report = repo_root / ".serving-capacity.json"
+            if args.capacity_plan:
+                capacity = plan_serving_capacity(
+                    capacity_report, args.target_qps, args.target_p95_ms, args.request_mix, stub_latencies
+                )
+            else:
+                # Keep serving the size planned earlier rather than falling back to the defaults
+                capacity = read_capacity_plan(capacity_report)
+            capacity = dict(capacity or {})
+            if args.workload_size is not None:
+                capacity["workload_size"] = args.workload_size
+            if args.scale_to_zero is not None:
+                capacity["scale_to_zero_enabled"] = args.scale_to_zero
+            with TIMER.stack(serving_dir.name):
+                rg_name = get_output(rg_dir, "resource_group_name")
+                uc_target = None
+                if DEFAULTS["serving_catalog_name"] is None:
+                    workspace_url = read_env_file(repo_root / ".env").get("DATABRICKS_WORKSPACE_URL")
+                    if workspace_url:
+                        uc_target = read_uc_target(workspace_url)
+                write_serving_tfvars(
+                    serving_dir,
+                    rg_name,
+                    capacity,
+                    args.candidate_model_version,
+                    args.candidate_traffic,
+                    uc_target,
+                )
+                apply_stack(serving_dir, force=args.force)
+
+        else:
+            terraform_root = repo_root / "terraform"
+            outputs = {}
+            stack_graph = build_stack_graph(terraform_root, FULL_DEPLOY_STACKS)
+            # For the timing report every stack also waits on the shared init phase
+            graph = {"terraform_init": [], **{name: [*deps, "terraform_init"] for name, deps in stack_graph.items()}}
+            run_stack_graph(stack_graph, full_deploy_tasks(terraform_root, outputs, args.force), args.jobs)
+            write_env_file(repo_root, workspace_url=outputs["workspace_url"])
+        ok = True
     except subprocess.CalledProcessError as exc:
         print(f"Command failed: {exc}")
         sys.exit(exc.returncode)
+    finally:
+        if timing_report is not None:
+            TIMER.finish(timing_report, ok, graph)
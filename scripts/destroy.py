@@ -1,16 +1,23 @@
 import argparse
+import http.client
 import json
 import shutil
 import subprocess
 import sys
-import urllib.error
-import urllib.request
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
+from databricks_client import DatabricksApiError, DatabricksClient
+from run_timer import RunTimer
+
 
 def run(cmd):
     print(f"\n$ {' '.join(cmd)}")
-    subprocess.check_call(cmd)
+    with TIMER.command(cmd):
+        subprocess.check_call(cmd)
 
 AZ_FALLBACK_PATHS = [
     r"C:\Program Files (x86)\Microsoft SDKs\Azure\CLI2\wbin\az.cmd",
@@ -19,7 +26,28 @@ AZ_FALLBACK_PATHS = [
 
 DATABRICKS_SP_APP_ID = "2ff814a6-3304-4ab8-85cb-cd0e6f879c1d"
 WORKSPACE_BASE_PATH = "/Shared/genai-agents"
-WORKSPACE_FILES_TO_DELETE = ["agent.py", "agents.py"]
+# Files the driver notebook generates next to itself; the notebooks stack cannot remove a
+# non-empty directory, so these are deleted before it is destroyed
+WORKSPACE_FILES_TO_DELETE = [
+    "agent.py",
+    "agents.py",
+    "uc_tool_specs.json",
+    "eval_runner.py",
+    "eval_predictions.jsonl",
+    "batch_inference.py",
+    "uc_target.py",
+    "uc_target.json",
+]
+# Generated directories, deleted recursively wherever they appear
+WORKSPACE_DIRS_TO_DELETE = [".eval_cache", ".llm_cache"]
+DEPLOY_MANIFEST_NAME = ".deploy-manifest.json"
+TOKEN_EXPIRY_MARGIN_SECONDS = 300
+TOKEN_CACHE = {}
+TOKEN_CACHE_LOCK = threading.Lock()
+OUTPUT_CACHE = {}
+WORKSPACE_DELETE_WORKERS = 8
+TIMER = RunTimer("destroy")
+DATABRICKS_CLIENT = DatabricksClient(pool_size=WORKSPACE_DELETE_WORKERS, on_call=TIMER.record_http)
 
 
 def find_az():
@@ -37,11 +65,25 @@ AZ_BIN = find_az()
 
 def run_capture(cmd):
     print(f"\n$ {' '.join(cmd)}")
-    return subprocess.check_output(cmd, text=True).strip()
+    with TIMER.command(cmd):
+        return subprocess.check_output(cmd, text=True).strip()
+
+
+def get_outputs(tf_dir):
+    """Returns all outputs of a stack as {name: value}, read with one `terraform output -json` call."""
+    key = Path(tf_dir).resolve()
+    if key not in OUTPUT_CACHE:
+        raw = json.loads(run_capture(["terraform", f"-chdir={tf_dir}", "output", "-json"]) or "{}")
+        OUTPUT_CACHE[key] = {name: output.get("value") for name, output in raw.items()}
+    return OUTPUT_CACHE[key]
 
 
 def get_output(tf_dir, output_name):
-    return run_capture(["terraform", f"-chdir={tf_dir}", "output", "-raw", output_name])
+    """Returns a single output, or None if the stack has no state or no such output."""
+    try:
+        return get_outputs(tf_dir).get(output_name)
+    except subprocess.CalledProcessError:
+        return None
 
 
 def hcl_value(value):
@@ -69,76 +111,145 @@ def ensure_rg_tfvars(tf_dir, rg_name):
     write_tfvars(tfvars_path, [("resource_group_name", rg_name)])
 
 
-def get_databricks_aad_token():
+def token_expiry(token):
+    if token.get("expires_on"):
+        return float(token["expires_on"])
+    if token.get("expiresOn"):
+        return datetime.strptime(token["expiresOn"], "%Y-%m-%d %H:%M:%S.%f").timestamp()
+    return 0
+
+
+def get_access_token(resource):
     if AZ_BIN is None:
         raise FileNotFoundError("Azure CLI not found. Install Azure CLI or ensure az is on PATH.")
-    return run_capture(
-        [
-            AZ_BIN,
-            "account",
-            "get-access-token",
-            "--resource",
-            DATABRICKS_SP_APP_ID,
-            "--query",
-            "accessToken",
-            "-o",
-            "tsv",
-        ]
-    )
+    with TOKEN_CACHE_LOCK:
+        cached = TOKEN_CACHE.get(resource)
+        if cached and cached[1] - TOKEN_EXPIRY_MARGIN_SECONDS > time.time():
+            return cached[0]
+        token = json.loads(run_capture([AZ_BIN, "account", "get-access-token", "--resource", resource, "-o", "json"]))
+        TOKEN_CACHE[resource] = (token["accessToken"], token_expiry(token))
+        return token["accessToken"]
 
 
-def normalize_databricks_host(host):
-    if not host:
-        return host
-    return host if host.startswith("https://") else f"https://{host}"
+def get_databricks_aad_token():
+    return get_access_token(DATABRICKS_SP_APP_ID)
 
 
-def databricks_api(host, token, method, path, payload=None):
-    url = f"{normalize_databricks_host(host).rstrip('/')}{path}"
-    data = None
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method=method)
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        with urllib.request.urlopen(req) as resp:
-            return json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as exc:
-        detail = exc.read().decode("utf-8")
-        raise RuntimeError(f"Databricks API error {exc.code}: {detail}") from exc
+def is_deletable_file(obj):
+    path = obj.get("path") or ""
+    return obj.get("object_type") != "DIRECTORY" and any(
+        path.endswith(f"/{name}") for name in WORKSPACE_FILES_TO_DELETE
+    )
 
 
-def cleanup_workspace_files(workspace_url):
-    token = get_databricks_aad_token()
+def walk_workspace(workspace_url, token, path, submit, summary):
+    """
+    Lists `path` page by page and descends into subdirectories depth-first. A directory's
+    targets are passed to `submit` once it and all its subdirectories have been listed, because
+    only then is it known whether the directory holds only deletable files (at any depth). In
+    that case nothing is submitted and True is returned, so the caller removes it with one
+    recursive delete instead. A subdirectory that cannot be listed is reported and kept, and the
+    walk continues; a failure listing WORKSPACE_BASE_PATH itself is raised.
+    """
+    targets = []
+    deletable = True
     try:
-        response = databricks_api(
-            workspace_url,
-            token,
-            "GET",
-            f"/api/2.0/workspace/list?path={WORKSPACE_BASE_PATH}",
-        )
-    except RuntimeError as exc:
-        print(f"Skipping workspace cleanup: {exc}")
-        return
+        for obj in DATABRICKS_CLIENT.paginate(
+            workspace_url, token, "/api/2.0/workspace/list", "objects", params={"path": path}
+        ):
+            summary["listed"] += 1
+            child = obj.get("path")
+            if not child:
+                continue
+            if obj.get("object_type") == "DIRECTORY" and child.rsplit("/", 1)[-1] in WORKSPACE_DIRS_TO_DELETE:
+                targets.append((child, True))
+            elif obj.get("object_type") == "DIRECTORY":
+                if walk_workspace(workspace_url, token, child, submit, summary):
+                    targets.append((child, True))
+                else:
+                    deletable = False
+            elif is_deletable_file(obj):
+                targets.append((child, False))
+            else:
+                deletable = False
+    except (RuntimeError, OSError, http.client.HTTPException) as exc:
+        if path == WORKSPACE_BASE_PATH:
+            raise
+        print(f"Could not list workspace directory {path}: {exc}")
+        summary["unlisted"] += 1
+        # Its remaining contents are unknown, so the directory itself must stay
+        deletable = False
+    if deletable and targets and path != WORKSPACE_BASE_PATH:
+        return True
+    for target, recursive in targets:
+        submit(target, recursive)
+    return False
+
+
+def cleanup_workspace_files(workspace_url, dry_run=False, workers=WORKSPACE_DELETE_WORKERS):
+    """
+    Deletes WORKSPACE_FILES_TO_DELETE and WORKSPACE_DIRS_TO_DELETE anywhere under
+    WORKSPACE_BASE_PATH. Other directories that hold nothing else are removed with a single
+    recursive delete. Each directory's deletes start on a bounded thread pool once its subtree
+    has been listed, while the walk moves on; with dry_run the targets are only printed.
+    """
+    token = get_databricks_aad_token()
+    summary = {"listed": 0, "unlisted": 0, "files": 0, "directories": 0, "missing": 0, "failed": 0}
+    summary_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(workers * 4)
+    started = time.perf_counter()
 
-    objects = response.get("objects", [])
-    for obj in objects:
-        path = obj.get("path")
-        if not path:
-            continue
-        if any(path.endswith(f"/{name}") for name in WORKSPACE_FILES_TO_DELETE):
-            databricks_api(
-                workspace_url,
-                token,
-                "POST",
-                "/api/2.0/workspace/delete",
-                {"path": path, "recursive": False},
-            )
-            print(f"Deleted workspace file: {path}")
+    def delete(path, recursive):
+        try:
+            if not dry_run:
+                DATABRICKS_CLIENT.request(
+                    workspace_url,
+                    token,
+                    "POST",
+                    "/api/2.0/workspace/delete",
+                    {"path": path, "recursive": recursive},
+                    # Deleting twice is harmless: the retry just reports 404
+                    idempotent=True,
+                )
+            outcome = "directories" if recursive else "files"
+            verb = "Would delete" if dry_run else "Deleted"
+            print(f"{verb} workspace {'directory' if recursive else 'file'}: {path}")
+        except DatabricksApiError as exc:
+            outcome = "missing" if exc.status == 404 else "failed"
+            if outcome == "failed":
+                print(f"Failed to delete {path}: {exc}")
+        except Exception as exc:
+            outcome = "failed"
+            print(f"Failed to delete {path}: {exc}")
+        finally:
+            in_flight.release()
+        with summary_lock:
+            summary[outcome] += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        def submit(path, recursive):
+            in_flight.acquire()
+            pool.submit(delete, path, recursive)
+
+        try:
+            walk_workspace(workspace_url, token, WORKSPACE_BASE_PATH, submit, summary)
+        except (RuntimeError, OSError, http.client.HTTPException) as exc:
+            print(f"Workspace cleanup stopped early: {exc}")
+
+    print(
+        f"Workspace cleanup{' (dry run)' if dry_run else ''}: {summary['listed']} objects listed, "
+        f"{summary['files']} files and {summary['directories']} directories "
+        f"{'to delete' if dry_run else 'deleted'}, {summary['missing']} already gone, "
+        f"{summary['failed']} failed, {summary['unlisted']} directories not listed "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return summary
 
 
 if __name__ == "__main__":
+    timing_report = None
+    ok = False
     try:
         parser = argparse.ArgumentParser(description="Destroy Terraform stacks for Databricks GenAI Agents.")
         group = parser.add_mutually_exclusive_group()
@@ -149,7 +260,25 @@ if __name__ == "__main__":
         group.add_argument("--notebooks-only", action="store_true", help="Destroy only the notebooks stack")
         group.add_argument("--job-only", action="store_true", help="Destroy only the Databricks job stack")
         group.add_argument("--serving-only", action="store_true", help="Destroy only the model serving endpoint stack")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="List the workspace files that would be cleaned up and the stacks that would be destroyed, then exit",
+        )
+        parser.add_argument(
+            "--cleanup-workers",
+            type=int,
+            default=WORKSPACE_DELETE_WORKERS,
+            help=f"Concurrent workspace delete requests (default {WORKSPACE_DELETE_WORKERS})",
+        )
+        parser.add_argument(
+            "--timing-report",
+            type=Path,
+            help="Where to write the JSON timing report (default .destroy-timing.json in the repo root)",
+        )
         args = parser.parse_args()
+        if args.cleanup_workers < 1:
+            parser.error("--cleanup-workers must be at least 1")
 
         repo_root = Path(__file__).resolve().parent.parent
         rg_dir = repo_root / "terraform" / "01_resource_group"
@@ -159,16 +288,10 @@ if __name__ == "__main__":
         notebooks_dir = repo_root / "terraform" / "05_notebooks"
         job_dir = repo_root / "terraform" / "06_job"
         serving_dir = repo_root / "terraform" / "07_model_serving_endpoint"
+        timing_report = args.timing_report or repo_root / ".destroy-timing.json"
 
-        try:
-            workspace_url = get_output(databricks_dir, "databricks_workspace_url")
-        except subprocess.CalledProcessError:
-            workspace_url = None
-
-        try:
-            rg_name = get_output(rg_dir, "resource_group_name")
-        except subprocess.CalledProcessError:
-            rg_name = None
+        workspace_url = get_output(databricks_dir, "databricks_workspace_url")
+        rg_name = get_output(rg_dir, "resource_group_name")
 
         if args.rg_only:
             tf_dirs = [rg_dir]
@@ -196,7 +319,13 @@ if __name__ == "__main__":
             ]
 
         if workspace_url and (args.notebooks_only or notebooks_dir in tf_dirs):
-            cleanup_workspace_files(workspace_url)
+            with TIMER.stack("workspace_cleanup"):
+                cleanup_workspace_files(workspace_url, dry_run=args.dry_run, workers=args.cleanup_workers)
+
+        if args.dry_run:
+            print(f"Dry run: would destroy {', '.join(tf_dir.name for tf_dir in tf_dirs)}")
+            ok = True
+            sys.exit(0)
 
         if rg_name is not None:
             ensure_rg_tfvars(notebooks_dir, rg_name)
@@ -206,7 +335,14 @@ if __name__ == "__main__":
         for tf_dir in tf_dirs:
             if not tf_dir.exists():
                 raise FileNotFoundError(f"Missing Terraform dir: {tf_dir}")
-            run(["terraform", f"-chdir={tf_dir}", "destroy", "-auto-approve"])
+            with TIMER.stack(tf_dir.name):
+                run(["terraform", f"-chdir={tf_dir}", "destroy", "-auto-approve"])
+            # deploy.py skips stacks whose inputs match this manifest; a destroyed stack must re-apply.
+            (tf_dir / DEPLOY_MANIFEST_NAME).unlink(missing_ok=True)
+        ok = True
     except subprocess.CalledProcessError as exc:
         print(f"Command failed: {exc}")
         sys.exit(exc.returncode)
+    finally:
+        if timing_report is not None:
+            TIMER.finish(timing_report, ok)
@@ -0,0 +1,169 @@
+"""
+Timing and tracing for deploy.py and destroy.py.
+
+Every subprocess, Terraform phase and REST call is recorded as an operation, attributed to
+the stack being worked on. At the end of a run RunTimer writes a JSON report and prints a
+summary of per-stack wall-clock time, the critical path and the slowest operations.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+
+SLOWEST_OPERATIONS = 10
+
+CURRENT_STACK = ContextVar("current_stack", default=None)
+
+
+def describe_command(cmd):
+    """Returns (kind, name, stack) for a subprocess command line."""
+    program = Path(cmd[0]).stem.lower()
+    if program == "terraform":
+        chdir = next((arg.split("=", 1)[1] for arg in cmd if arg.startswith("-chdir=")), None)
+        phase = next((arg for arg in cmd[1:] if not arg.startswith("-")), "")
+        return "terraform", f"terraform {phase}".strip(), Path(chdir).name if chdir else None
+    words = [program]
+    for arg in cmd[1:]:
+        if arg.startswith("-"):
+            break
+        words.append(arg)
+    return "subprocess", " ".join(words), None
+
+
+class RunTimer:
+    def __init__(self, run_name):
+        self.run_name = run_name
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.operations = []
+        self.stacks = {}
+        self._lock = threading.Lock()
+
+    def _offset(self, started):
+        return round(started - self.started, 3)
+
+    def record(self, kind, name, started, seconds, ok=True, stack=None, **details):
+        operation = {
+            "kind": kind,
+            "name": name,
+            "stack": stack or CURRENT_STACK.get(),
+            "start_offset": self._offset(started),
+            "seconds": round(seconds, 3),
+            "ok": ok,
+            **details,
+        }
+        with self._lock:
+            self.operations.append(operation)
+
+    @contextmanager
+    def operation(self, kind, name, stack=None, **details):
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(kind, name, started, time.perf_counter() - started, ok, stack, **details)
+
+    @contextmanager
+    def command(self, cmd):
+        kind, name, stack = describe_command(cmd)
+        with self.operation(kind, name, stack):
+            yield
+
+    @contextmanager
+    def stack(self, name):
+        """Times a whole stack; operations inside are attributed to it."""
+        token = CURRENT_STACK.set(name)
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            CURRENT_STACK.reset(token)
+            with self._lock:
+                self.stacks[name] = {
+                    "start_offset": self._offset(started),
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "ok": ok,
+                }
+
+    def record_http(self, method, path, status, started, seconds):
+        """DatabricksClient.on_call hook."""
+        ok = status is not None and status < 400
+        self.record("http", f"{method} {path}", started, seconds, ok, status=status)
+
+    def critical_path(self, graph=None):
+        """
+        Longest dependency chain by stack wall time. `graph` maps stack -> dependencies; without
+        one the stacks ran one after another and all of them are on the path.
+        """
+        stacks = {name: info["seconds"] for name, info in self.stacks.items()}
+        if graph is None:
+            order = sorted(stacks, key=lambda name: self.stacks[name]["start_offset"])
+            return {"stacks": order, "seconds": round(sum(stacks.values()), 3)}
+        finish = {}
+
+        def finish_time(name):
+            if name not in finish:
+                deps = [dep for dep in graph.get(name, []) if dep in stacks]
+                previous = max(deps, key=finish_time, default=None)
+                finish[name] = (stacks[name] + (finish_time(previous)[0] if previous else 0), previous)
+            return finish[name]
+
+        last = max(stacks, key=lambda name: finish_time(name)[0], default=None)
+        path = []
+        while last is not None:
+            path.append(last)
+            last = finish[last][1]
+        return {
+            "stacks": list(reversed(path)),
+            "seconds": round(finish[path[0]][0], 3) if path else 0.0,
+        }
+
+    def report(self, ok=True, graph=None):
+        with self._lock:
+            operations = sorted(self.operations, key=lambda op: op["start_offset"])
+        for name, info in self.stacks.items():
+            info["operations"] = sum(1 for op in operations if op["stack"] == name)
+        return {
+            "run": self.run_name,
+            "started_at": self.started_at.isoformat(),
+            "total_seconds": round(time.perf_counter() - self.started, 3),
+            "ok": ok,
+            "stacks": dict(sorted(self.stacks.items(), key=lambda item: item[1]["start_offset"])),
+            "critical_path": self.critical_path(graph),
+            "slowest_operations": sorted(operations, key=lambda op: op["seconds"], reverse=True)[
+                :SLOWEST_OPERATIONS
+            ],
+            "operations": operations,
+        }
+
+    def finish(self, report_path, ok=True, graph=None):
+        """Writes the JSON report to report_path and prints the summary table."""
+        report = self.report(ok, graph)
+        Path(report_path).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print_summary(report)
+        print(f"Timing report written to {report_path}")
+        return report
+
+
+def print_summary(report):
+    status = "" if report["ok"] else " (failed)"
+    print(f"\n{report['run']} timing{status}: {report['total_seconds']:.1f}s total")
+    if report["stacks"]:
+        print(f"  {'Stack':<32}{'Wall (s)':>10}{'Ops':>6}")
+        for name, info in report["stacks"].items():
+            marker = "" if info["ok"] else "  failed"
+            print(f"  {name:<32}{info['seconds']:>10.1f}{info['operations']:>6}{marker}")
+        path = report["critical_path"]
+        print(f"  Critical path ({path['seconds']:.1f}s): {' -> '.join(path['stacks'])}")
+    if report["slowest_operations"]:
+        print("  Slowest operations:")
+        for op in report["slowest_operations"]:
+            print(f"  {op['seconds']:>10.1f}s  {op['name']:<40}{op['stack'] or ''}")
@@ -42,6 +42,13 @@ locals {
     "_"
   )
   resolved_model_name = "${local.resolved_catalog_name}.${var.schema_name}.${var.model_name}"
+
+  # A candidate version, when set, is served next to the primary one and takes a share of the traffic
+  candidate_served_models = var.candidate_model_version == null ? [] : [{
+    name    = coalesce(var.candidate_served_model_name, "${var.served_model_name}-candidate")
+    version = var.candidate_model_version
+  }]
+  primary_traffic_percentage = var.candidate_model_version == null ? 100 : 100 - var.candidate_traffic_percentage
 }
 
 resource "databricks_model_serving" "endpoint" {
@@ -57,10 +64,30 @@ resource "databricks_model_serving" "endpoint" {
       scale_to_zero_enabled = var.scale_to_zero_enabled
     }
 
+    dynamic "served_models" {
+      for_each = local.candidate_served_models
+      content {
+        name                  = served_models.value.name
+        model_name            = local.resolved_model_name
+        model_version         = served_models.value.version
+        workload_size         = var.workload_size
+        workload_type         = var.workload_type
+        scale_to_zero_enabled = var.scale_to_zero_enabled
+      }
+    }
+
     traffic_config {
       routes {
         served_model_name  = var.served_model_name
-        traffic_percentage = 100
+        traffic_percentage = local.primary_traffic_percentage
+      }
+
+      dynamic "routes" {
+        for_each = local.candidate_served_models
+        content {
+          served_model_name  = routes.value.name
+          traffic_percentage = var.candidate_traffic_percentage
+        }
       }
     }
   }
@@ -56,3 +56,26 @@ variable "scale_to_zero_enabled" {
   description = "Whether to scale the endpoint to zero when idle"
   default     = true
 }
+
+variable "candidate_model_version" {
+  type        = string
+  description = "Optional second model version to serve alongside model_version for comparison"
+  default     = null
+}
+
+variable "candidate_served_model_name" {
+  type        = string
+  description = "Name of the candidate served model (defaults to served_model_name with a -candidate suffix)"
+  default     = null
+}
+
+variable "candidate_traffic_percentage" {
+  type        = number
+  description = "Percentage of traffic routed to the candidate model version"
+  default     = 0
+
+  validation {
+    condition     = var.candidate_traffic_percentage >= 0 && var.candidate_traffic_percentage <= 100
+    error_message = "candidate_traffic_percentage must be between 0 and 100."
+  }
+}
@@ -0,0 +1,84 @@
+import json
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from databricks_client import DatabricksApiError, DatabricksClient  # noqa: E402
+
+
+class StubServer:
+    """Local API stub answering every request with the next status in `statuses` (then 200)."""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                stub.requests.append((self.command, self.path))
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                body = json.dumps({"status": status}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = respond
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RequestRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.client = DatabricksClient(max_retries=3, sleep=self.sleeps.append)
+
+    def stub(self, statuses):
+        server = StubServer(statuses)
+        self.addCleanup(server.close)
+        self.addCleanup(self.client.close)
+        return server
+
+    def test_post_hitting_500_is_sent_once(self):
+        server = self.stub([500, 500, 500, 500])
+        with self.assertRaises(DatabricksApiError) as raised:
+            self.client.request(server.host, "token", "POST", "/api/2.1/jobs/run-now", {"job_id": 1})
+        self.assertEqual(raised.exception.status, 500)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_post_retries_unprocessed_statuses(self):
+        server = self.stub([429, 503])
+        self.assertEqual(self.client.request(server.host, "token", "POST", "/api/2.0/x", {}), {"status": 200})
+        self.assertEqual(len(server.requests), 3)
+
+    def test_idempotent_post_retries_500(self):
+        server = self.stub([500])
+        self.client.request(server.host, "token", "POST", "/api/2.0/workspace/delete", {}, idempotent=True)
+        self.assertEqual(len(server.requests), 2)
+
+    def test_get_retries_500(self):
+        server = self.stub([500, 502])
+        self.assertEqual(self.client.request(server.host, "token", "GET", "/api/2.0/x"), {"status": 200})
+        self.assertEqual(len(server.requests), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()